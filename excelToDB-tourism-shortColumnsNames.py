@@ -1,8 +1,18 @@
+import csv
+import hashlib
+import itertools
+import json
 import os
 import re
-import pandas as pd
+import tempfile
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from openai import OpenAI
 
 # Load environment variables
@@ -10,7 +20,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Setup logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Retrieve environment variables
@@ -24,23 +34,47 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 # Initialize OpenAI client
 client = OpenAI(api_key=OPENAI_API_KEY)
 
+# Column-name generation settings; results are cached on disk so reruns skip the OpenAI round trip
+COLUMN_NAME_MODEL = "gpt-4-turbo-preview"
+COLUMN_NAME_BATCH_SIZE = 100
+COLUMN_NAME_CACHE_DIR = os.path.expanduser('~/.cache/db_chatbot/colnames')
+
+# Arrow column types inferred on the first run are cached here and passed explicitly on later runs
+CSV_SCHEMA_CACHE_DIR = os.path.expanduser('~/.cache/db_chatbot/csvtypes')
+
+# Rows converted from the Arrow table to pandas per chunk, bounding pandas memory to one chunk at a time
+CSV_CHUNKSIZE = 50_000
+
+# Rows per multi-row INSERT; capped so rows * columns stays under MySQL's bound-parameter limit
+INSERT_CHUNKSIZE = 1000
+MAX_BIND_PARAMS = 60000
+
+# Bytes of the 65535-byte MySQL row limit that VARCHAR columns may use; the rest is left for other columns
+VARCHAR_BYTE_BUDGET = 60000
+
+# Patterns used by snake_case_convert, compiled once at import
+_RE_SPACE = re.compile(r'[\s\-]+')
+_RE_CAMEL1 = re.compile('(.)([A-Z][a-z]+)')
+_RE_CAMEL2 = re.compile('([a-z0-9])([A-Z])')
+_RE_DUNDER = re.compile(r'__+')
+
 def snake_case_convert(name):
     """ Convert names to snake_case and lowercase, handling spaces and special characters. """
     # Replace spaces and special characters with underscores
-    name = re.sub(r'[\s\-]+', '_', name)
+    name = _RE_SPACE.sub('_', name)
     # Handle camel case by inserting underscores.
-    name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    name = re.sub('([a-z0-9])([A-Z])', r'\1_\2', name)
+    name = _RE_CAMEL1.sub(r'\1_\2', name)
+    name = _RE_CAMEL2.sub(r'\1_\2', name)
     # Convert to lowercase
     name = name.lower()
     # Remove any double underscores caused by previous replacements
-    name = re.sub(r'__+', '_', name)
+    name = _RE_DUNDER.sub('_', name)
     # Strip leading/trailing underscores
     name = name.strip('_')
     return name
 
-def generate_natural_column_names(columns):
-    """ Generates natural, database-appropriate column names using OpenAI and converts them to snake case. """
+def request_natural_column_names(columns):
+    """ Asks OpenAI for natural names for one batch of columns, falling back to the snake_cased originals on any error. Returns the names and whether the request succeeded. """
     try:
         prompt_text = (
             "Translate the following database column names into a comma-separated list of natural, descriptive, and unique names. "
@@ -50,76 +84,236 @@ def generate_natural_column_names(columns):
         )
         logger.info("Sending prompt to OpenAI: %s", prompt_text)
         response = client.chat.completions.create(
-            model="gpt-4-turbo-preview",
+            model=COLUMN_NAME_MODEL,
             messages=[{"role": "system", "content": prompt_text}]
         )
         natural_names = response.choices[0].message.content.strip().split(", ")
+        if len(natural_names) != len(columns):
+            raise ValueError(f"expected {len(columns)} names, got {len(natural_names)}")
         # Convert each name to snake_case
-        snake_case_names = [snake_case_convert(name) for name in natural_names]
-        logger.info("Natural column names generated successfully: %s", snake_case_names)
-        return snake_case_names
+        return [snake_case_convert(name) for name in natural_names], True
     except Exception as e:
         logger.error("Failed to generate column names: %s", e)
-        return [snake_case_convert(name) for name in columns]  # Fallback to original names if there's an error, converted to snake_case
+        return [snake_case_convert(name) for name in columns], False  # Fallback to original names if there's an error, converted to snake_case
+
+def deduplicate_names(names):
+    """ Appends a numeric suffix to repeated names so every column name is unique. """
+    counts = {}
+    unique_names = []
+    for name in names:
+        counts[name] = counts.get(name, 0) + 1
+        unique_names.append(name if counts[name] == 1 else f"{name}_{counts[name]}")
+    return unique_names
+
+def generate_natural_column_names(columns):
+    """ Generates natural, database-appropriate column names using OpenAI, caching the result on disk keyed by the original column names. """
+    key = hashlib.sha256("\n".join([COLUMN_NAME_MODEL, *columns]).encode()).hexdigest()
+    cache_path = os.path.join(COLUMN_NAME_CACHE_DIR, f"{key}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding='utf-8') as f:
+            snake_case_names = json.load(f)
+        logger.info("Loaded cached column names from %s", cache_path)
+        return snake_case_names
+
+    # Wide files are split into batches that are requested concurrently
+    batches = [columns[i:i + COLUMN_NAME_BATCH_SIZE] for i in range(0, len(columns), COLUMN_NAME_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=min(8, max(1, len(batches)))) as executor:
+        results = list(executor.map(request_natural_column_names, batches))
+    snake_case_names = deduplicate_names([name for names, _ in results for name in names])
+    logger.info("Natural column names generated successfully: %s", snake_case_names)
+
+    # Only cache complete answers so failed batches are retried on the next run
+    if all(succeeded for _, succeeded in results):
+        os.makedirs(COLUMN_NAME_CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'w', encoding='utf-8') as f:
+            json.dump(snake_case_names, f)
+    return snake_case_names
 
 def setup_database_connection():
     """ Set up database connection using environment variables. """
     try:
         db_uri = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_DATABASE}?charset=utf8mb4&connect_timeout=10&read_timeout=10&write_timeout=10"
-        engine = create_engine(db_uri, echo=True)
+        # local_infile lets load_data_infile stream the CSV to the server; SQL echo follows LOG_LEVEL
+        engine = create_engine(db_uri, echo=logger.isEnabledFor(logging.INFO), connect_args={'local_infile': True})
         logger.info("Database engine created successfully.")
         return engine
     except Exception as e:
         logger.error("Error establishing database connection: %s", e)
         raise
 
-def create_table_from_csv(df, conn, table_name):
-    """ Creates a table from a DataFrame with appropriate data type mappings. """
+def text_column_types(text_lengths):
+    """ Sizes a VARCHAR for each text column from its longest value, falling back to TEXT for long values or once the row-size budget is spent. """
+    column_types = {}
+    budget = VARCHAR_BYTE_BUDGET
+    # Size the shortest columns first so the budget covers as many columns as possible
+    for col, max_len in sorted(text_lengths.items(), key=lambda item: item[1]):
+        length = min(max(64, int(max_len * 1.2)), 1024)
+        row_bytes = length * 4 + 2  # utf8mb4 characters plus the length prefix
+        if max_len <= 1000 and row_bytes <= budget:
+            column_types[col] = f"VARCHAR({length})"
+            budget -= row_bytes
+        else:
+            column_types[col] = 'TEXT'
+    return column_types
+
+def create_table_from_csv(df, conn, table_name, text_lengths=None):
+    """ Creates a table from a DataFrame with appropriate data type mappings, sizing text columns from text_lengths when given. """
     try:
         dtype_mapping = {
             'int64': 'BIGINT',
-            'float64': 'DECIMAL(10,2)',
+            'float64': 'DOUBLE',
             'object': 'TEXT',
             'bool': 'BOOLEAN',
             'datetime64[ns]': 'DATETIME',
             'timedelta[ns]': 'TIME'
         }
+        column_types = text_column_types(text_lengths or {})
         conn.execute(text(f"DROP TABLE IF EXISTS `{table_name}`"))
-        columns_definitions = ', '.join([f"`{col}` {dtype_mapping[str(df.dtypes[col])]}" for col in df.columns])
+        # Any dtype without a mapping is stored as text, as the values would have been read before type inference
+        columns_definitions = ', '.join([f"`{col}` {column_types.get(col) or dtype_mapping.get(str(df.dtypes[col]), 'TEXT')}" for col in df.columns])
         create_table_statement = text(f"CREATE TABLE IF NOT EXISTS `{table_name}` (id INT AUTO_INCREMENT PRIMARY KEY, {columns_definitions})")
         conn.execute(create_table_statement)
-        logger.info(f"Table {table_name} created successfully.")
+        logger.info("Table %s created successfully.", table_name)
     except Exception as e:
         logger.error("Error creating table %s: %s", table_name, e)
         raise
 
 def insert_data_from_csv(df, conn, table_name):
-    """ Inserts data from a DataFrame into the specified table. """
+    """ Inserts data from a DataFrame into the specified table using multi-row INSERT statements. """
     try:
-        df.to_sql(table_name, con=conn, if_exists='append', index=False)
-        logger.info(f"Data inserted into table {table_name} successfully.")
+        chunksize = max(1, min(INSERT_CHUNKSIZE, MAX_BIND_PARAMS // max(1, len(df.columns))))
+        df.to_sql(table_name, con=conn, if_exists='append', index=False, method='multi', chunksize=chunksize)
+        logger.info("Data inserted into table %s successfully.", table_name)
     except Exception as e:
         logger.error("Error during data insertion into table %s: %s", table_name, e)
         raise
 
+def load_data_infile(chunks, conn, table_name):
+    """ Writes DataFrame chunks to a temporary CSV file and bulk-loads it server-side with LOAD DATA LOCAL INFILE. """
+    columns = None
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', newline='', delete=False) as f:
+        path = f.name
+        for chunk in chunks:
+            columns = chunk.columns
+            # BOOLEAN is TINYINT in MySQL, so write booleans as 0/1; missing values are written as empty fields
+            chunk = chunk.astype({col: 'int8' for col in chunk.columns[chunk.dtypes == bool]})
+            chunk.to_csv(f, header=False, index=False, quoting=csv.QUOTE_ALL, lineterminator='\n')
+    try:
+        if columns is None:
+            return
+        variables = ', '.join(f"@v{i}" for i in range(len(columns)))
+        assignments = ', '.join(f"`{col}` = NULLIF(@v{i}, '')" for i, col in enumerate(columns))
+        conn.execute(text(f"""
+            LOAD DATA LOCAL INFILE :path INTO TABLE `{table_name}`
+            CHARACTER SET utf8mb4
+            FIELDS TERMINATED BY ',' ENCLOSED BY '"' ESCAPED BY ''
+            LINES TERMINATED BY '\\n'
+            ({variables})
+            SET {assignments}
+        """), {'path': path})
+        logger.info("Data loaded into table %s with LOAD DATA LOCAL INFILE.", table_name)
+    finally:
+        os.remove(path)
+
+def csv_schema_cache_path(file_path):
+    """ Returns the cache file for a CSV's column types, keyed by its header line. """
+    with open(file_path, encoding='utf-8', newline='') as f:
+        header = next(csv.reader(f, delimiter=';'), [])
+    key = hashlib.sha256("\n".join(header).encode()).hexdigest()
+    return os.path.join(CSV_SCHEMA_CACHE_DIR, f"{key}.arrow")
+
+def read_csv_table(file_path, schema=None):
+    """ Parses a CSV file with PyArrow's multi-threaded reader, using explicit column types when a schema is given. """
+    convert_options = pv.ConvertOptions(column_types={field.name: field.type for field in schema} if schema else None)
+    return pv.read_csv(
+        file_path,
+        read_options=pv.ReadOptions(encoding='utf-8'),
+        parse_options=pv.ParseOptions(delimiter=';'),
+        convert_options=convert_options,
+    )
+
 def read_and_prepare_csv(file_path):
-    """ Reads a CSV file, applying encoding and delimiter settings, handling data types explicitly to avoid DtypeWarnings. """
+    """ Parses a CSV file and renames its columns to natural names, reusing the column types inferred on a previous run. """
     try:
-        df = pd.read_csv(file_path, encoding='utf-8', delimiter=';', low_memory=False)
-        df.columns = generate_natural_column_names(df.columns.tolist())
-        return df
+        schema_path = csv_schema_cache_path(file_path)
+        schema = None
+        if os.path.exists(schema_path):
+            with open(schema_path, 'rb') as f:
+                schema = pa.ipc.read_schema(pa.py_buffer(f.read()))
+        try:
+            table = read_csv_table(file_path, schema)
+        except pa.ArrowInvalid as e:
+            if schema is None:
+                raise
+            # The data no longer fits the cached types; infer them again
+            logger.warning("Cached column types no longer match the CSV, inferring them again: %s", e)
+            schema = None
+            table = read_csv_table(file_path)
+        if schema is None:
+            os.makedirs(CSV_SCHEMA_CACHE_DIR, exist_ok=True)
+            with open(schema_path, 'wb') as f:
+                f.write(table.schema.serialize().to_pybytes())
+        return drop_timezones(table.rename_columns(generate_natural_column_names(table.column_names)))
     except Exception as e:
         logger.error("Failed to read CSV: %s", e)
         raise
 
+def drop_timezones(table):
+    """ Casts timezone-aware timestamp columns (ISO values ending in 'Z') to naive UTC, which is what a DATETIME column holds. """
+    for index, field in enumerate(table.schema):
+        if pa.types.is_timestamp(field.type) and field.type.tz is not None:
+            table = table.set_column(index, field.name, table[field.name].cast(pa.timestamp(field.type.unit)))
+    return table
+
+def measure_text_columns(table):
+    """ Returns the length of the longest value in each string column of an Arrow table. """
+    return {
+        field.name: pc.max(pc.utf8_length(table[field.name])).as_py() or 0
+        for field in table.schema
+        if pa.types.is_string(field.type)
+    }
+
+def iter_dataframe_chunks(table):
+    """ Yields an Arrow table as DataFrames of CSV_CHUNKSIZE rows. """
+    for offset in range(0, table.num_rows, CSV_CHUNKSIZE):
+        yield table.slice(offset, CSV_CHUNKSIZE).to_pandas(coerce_temporal_nanoseconds=True)
+
+@contextmanager
+def bulk_load_session(conn):
+    """ Disables unique and foreign key checks on the session for the duration of a bulk load, then restores the previous values. """
+    previous = conn.execute(text("SELECT @@SESSION.unique_checks, @@SESSION.foreign_key_checks")).fetchone()
+    conn.execute(text("SET SESSION unique_checks=0, foreign_key_checks=0"))
+    try:
+        yield
+    finally:
+        conn.execute(text("SET SESSION unique_checks=:unique_checks, foreign_key_checks=:foreign_key_checks"),
+                     {'unique_checks': previous[0], 'foreign_key_checks': previous[1]})
+
+def prefetch(iterator):
+    """ Yields items from an iterator while the next item is produced on a background thread. """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(next, iterator, None)
+        while (item := pending.result()) is not None:
+            pending = executor.submit(next, iterator, None)
+            yield item
+
 # Main execution block
 if __name__ == "__main__":
     try:
         engine = setup_database_connection()
-        with engine.begin() as conn:
-            df = read_and_prepare_csv('tourismfinal.csv')
-            create_table_from_csv(df, conn, 'tourism_data')
-            insert_data_from_csv(df, conn, 'tourism_data')
+        with engine.begin() as conn, bulk_load_session(conn):
+            table = read_and_prepare_csv('tourismfinal.csv')
+            # Convert the next chunk while the current one is written to the temporary CSV; the upload starts once the file is complete
+            chunks = prefetch(iter_dataframe_chunks(table))
+            first_chunk = next(chunks)
+            create_table_from_csv(first_chunk, conn, 'tourism_data', text_lengths=measure_text_columns(table))
+            try:
+                load_data_infile(itertools.chain([first_chunk], chunks), conn, 'tourism_data')
+            except DBAPIError as e:
+                # local_infile may be disabled on the server; fall back to multi-row INSERTs
+                logger.warning("LOAD DATA LOCAL INFILE failed, falling back to INSERT statements: %s", e)
+                for chunk in iter_dataframe_chunks(table):
+                    insert_data_from_csv(chunk, conn, 'tourism_data')
         logger.info("Script execution completed successfully.")
     except Exception as e:
         logger.error("An error occurred during the script execution: %s", e)
@@ -3,12 +3,13 @@ import pandas as pd
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 import logging
+from contextlib import contextmanager
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'), format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Database connection details
@@ -23,7 +24,7 @@ try:
     engine = create_engine(f'mysql+pymysql://{username}:{password}@{host}:{port}/{database}?connect_timeout=10', echo=False)
     logger.info("Database engine created successfully.")
 except Exception as e:
-    logger.error(f"Error creating database engine: {e}")
+    logger.error("Error creating database engine: %s", e)
     raise
 
 excel_file = 'tourism_data.xlsx'
@@ -35,6 +36,9 @@ def excel_col_index_to_letter(index):
         letter = chr(65 + remainder) + letter
     return letter
 
+# Precomputed letters for every 1-based column index up to ZZZ; index 0 is unused
+EXCEL_LETTERS = [excel_col_index_to_letter(index) for index in range(18279)]
+
 def create_tables(conn):
     try:
         conn.execute(text("DROP TABLE IF EXISTS article_data;"))
@@ -59,13 +63,13 @@ def create_tables(conn):
         """))
         logger.info("Tables created successfully.")
     except SQLAlchemyError as e:
-        logger.error(f"Error creating tables: {e}")
+        logger.error("Error creating tables: %s", e)
         raise e
 
 def insert_column_names(df, conn):
     column_ids = {}
     for index, col in enumerate(df.columns):
-        col_letter = excel_col_index_to_letter(index + 1)
+        col_letter = EXCEL_LETTERS[index + 1]
         try:
             conn.execute(text("""
             INSERT INTO column_names (column_name, excel_column_position)
@@ -74,26 +78,26 @@ def insert_column_names(df, conn):
             result = conn.execute(text("SELECT id FROM column_names WHERE column_name = :column_name"), {'column_name': col})
             column_id = result.fetchone()[0]
             column_ids[col] = column_id
-            logger.info(f"Column '{col}' inserted with ID {column_id}.")
+            logger.info("Column '%s' inserted with ID %s.", col, column_id)
         except SQLAlchemyError as e:
-            logger.error(f"Error inserting column name '{col}': {e}")
+            logger.error("Error inserting column name '%s': %s", col, e)
             raise e
     return column_ids
 
 def insert_article_data_optimized(df, column_ids, conn):
     logger.info("Inserting article data in bulk...")
-    bulk_data = []
-    for index, row in df.iterrows():
-        article_id = index + 1
-        for col in df.columns:
-            value = row[col]
-            if col in column_ids:
-                bulk_data.append({
-                    'article_id': article_id,
-                    'column_id': column_ids[col],
-                    'value': value if not pd.isnull(value) else None
-                })
-                
+    # Replace NaN with None in one pass, then reshape to (article, column, value) rows
+    values = df[list(column_ids)]
+    values = values.astype(object).where(values.notna(), None)
+    records = (
+        values.stack(future_stack=True)
+        .rename_axis(['row', 'column'])
+        .reset_index(name='value')
+    )
+    records['article_id'] = records['row'] + 1
+    records['column_id'] = records['column'].map(column_ids)
+    bulk_data = records[['article_id', 'column_id', 'value']].to_dict('records')
+
     try:
         chunk_size = 1000
         for i in range(0, len(bulk_data), chunk_size):
@@ -104,21 +108,32 @@ def insert_article_data_optimized(df, column_ids, conn):
             """), chunk)
         logger.info("Bulk data insertion completed successfully.")
     except SQLAlchemyError as e:
-        logger.error(f"Error during bulk data insertion: {e}")
+        logger.error("Error during bulk data insertion: %s", e)
         raise e
 
-with engine.begin() as conn:
+# Disable unique and foreign key checks for the bulk load, then restore the session's previous values
+@contextmanager
+def bulk_load_session(conn):
+    previous = conn.execute(text("SELECT @@SESSION.unique_checks, @@SESSION.foreign_key_checks")).fetchone()
+    conn.execute(text("SET SESSION unique_checks=0, foreign_key_checks=0"))
+    try:
+        yield
+    finally:
+        conn.execute(text("SET SESSION unique_checks=:unique_checks, foreign_key_checks=:foreign_key_checks"),
+                     {'unique_checks': previous[0], 'foreign_key_checks': previous[1]})
+
+with engine.begin() as conn, bulk_load_session(conn):
     create_tables(conn)
-    xls = pd.ExcelFile(excel_file)
+    xls = pd.ExcelFile(excel_file, engine='calamine')
     for sheet_name in xls.sheet_names:
-        logger.info(f"Processing sheet: {sheet_name}")
+        logger.info("Processing sheet: %s", sheet_name)
         try:
             df = pd.read_excel(xls, sheet_name=sheet_name)
             column_ids = insert_column_names(df, conn)
             insert_article_data_optimized(df, column_ids, conn)
-            logger.info(f"Sheet {sheet_name} processed successfully.")
+            logger.info("Sheet %s processed successfully.", sheet_name)
         except Exception as e:
-            logger.error(f"Error processing sheet '{sheet_name}': {e}")
+            logger.error("Error processing sheet '%s': %s", sheet_name, e)
             raise e
 
 logger.info("Script execution completed.")
@@ -1,15 +1,17 @@
 import os
 import re
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import bindparam, create_engine, text
 from sqlalchemy.exc import SQLAlchemyError
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Load environment variables
 from dotenv import load_dotenv
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
 # Database connection details from environment variables
@@ -18,11 +20,17 @@ password = os.getenv('DB_PASSWORD')
 host = os.getenv('DB_HOST')
 database = os.getenv('DB_DATABASE')
 
+# Sheets are read and loaded by a thread pool sharing the engine's connection pool
+MAX_WORKERS = 4
+
 try:
-    engine = create_engine(f'mysql+pymysql://{username}:{password}@{host}/{database}', echo=True)
+    # SQL echo follows LOG_LEVEL so raising it to WARNING silences the per-statement logging too
+    engine = create_engine(f'mysql+pymysql://{username}:{password}@{host}/{database}',
+                           echo=logger.isEnabledFor(logging.INFO),
+                           pool_size=MAX_WORKERS, max_overflow=MAX_WORKERS)
     logger.info("Database engine created successfully.")
 except Exception as e:
-    logger.error(f"Error creating database engine: {e}")
+    logger.error("Error creating database engine: %s", e)
 
 excel_file = 'encuesta.xlsx'
 excel_file = 'encuesta_completa.xlsx'
@@ -34,12 +42,19 @@ def excel_col_index_to_letter(index):
         letter = chr(65 + remainder) + letter
     return letter
 
+# Precomputed letters for every 1-based column index up to ZZZ; index 0 is unused
+EXCEL_LETTERS = [excel_col_index_to_letter(index) for index in range(18279)]
+
+# Question columns start with 'P' and digits, optionally followed by an underscore
+_RE_PFX = re.compile(r'^P\d+_?')
+_RE_QUESTION = re.compile(r'^P\d+')
+
 def clean_question_text(question_text):
     """
     Cleans the question text by removing the initial 'P' followed by digits
     and optionally an underscore and additional characters at the beginning.
     """
-    return re.sub(r'^P\d+_?', '', question_text).strip()
+    return _RE_PFX.sub('', question_text).strip()
 
 def create_tables(conn):
     try:
@@ -65,64 +80,99 @@ def create_tables(conn):
         """))
         logger.info("Tables created successfully.")
     except SQLAlchemyError as e:
-        logger.error(f"Error creating tables: {e}")
+        logger.error("Error creating tables: %s", e)
 
 
 def insert_questions_get_ids(df, conn):
     question_ids = {}
-    data_to_insert = []
-    for index, col in enumerate(df.columns):
-        col_letter = excel_col_index_to_letter(index + 1)
-        original_col = col  # Keep the original column name
-        cleaned_col = clean_question_text(col)  # Cleaned column name for insertion
-        if re.match(r'^P\d+', col):
-            data_to_insert.append({'original_question': original_col, 'question': cleaned_col, 'col_letter': col_letter})
+    # Filter the question columns and derive their cleaned text and Excel letters in one pass
+    names = df.columns.astype(str)
+    mask = names.str.match(_RE_QUESTION)
+    original_cols = df.columns[mask]  # Keep the original column names
+    cleaned_cols = names[mask].map(clean_question_text)  # Cleaned names for insertion
+    col_letters = [EXCEL_LETTERS[index + 1] for index in np.flatnonzero(mask)]
+    data_to_insert = [
+        {'original_question': original_col, 'question': cleaned_col, 'col_letter': col_letter}
+        for original_col, cleaned_col, col_letter in zip(original_cols, cleaned_cols, col_letters)
+    ]
 
     if data_to_insert:
         try:
-            for item in data_to_insert:
-                conn.execute(text("""
-                INSERT INTO questions (question_text, excel_column_position)
-                VALUES (:question, :col_letter)
-                ON DUPLICATE KEY UPDATE id=LAST_INSERT_ID(id), question_text=VALUES(question_text), excel_column_position=VALUES(excel_column_position)
-                """), {'question': item['question'], 'col_letter': item['col_letter']})
-                result = conn.execute(text("SELECT id FROM questions WHERE question_text = :question"), {'question': item['question']})
-                question_id = result.fetchone()[0]
-                question_ids[item['original_question']] = question_id
-                logger.info(f"Question '{item['question']}' inserted or updated with ID {question_id}.")
+            conn.execute(text("""
+            INSERT INTO questions (question_text, excel_column_position)
+            VALUES (:question, :col_letter)
+            ON DUPLICATE KEY UPDATE id=LAST_INSERT_ID(id), question_text=VALUES(question_text), excel_column_position=VALUES(excel_column_position)
+            """), [{'question': item['question'], 'col_letter': item['col_letter']} for item in data_to_insert])
+            # Fetch every id in one round trip; ORDER BY id lets the newest row win for repeated texts
+            result = conn.execute(
+                text("SELECT id, question_text FROM questions WHERE question_text IN :questions ORDER BY id")
+                .bindparams(bindparam('questions', expanding=True)),
+                {'questions': [item['question'] for item in data_to_insert]},
+            )
+            ids_by_text = {question_text: question_id for question_id, question_text in result}
+            question_ids = {item['original_question']: ids_by_text[item['question']] for item in data_to_insert}
+            logger.info("%d questions inserted or updated.", len(question_ids))
         except SQLAlchemyError as e:
-            logger.error(f"Error inserting questions: {e}")
+            logger.error("Error inserting questions: %s", e)
     return question_ids
 
 def insert_responses(df, question_ids, conn):
-    data_to_insert = []
-    for index, row in df.iterrows():
-        for question, response in row.items():
-            if question in question_ids:
-                response = response if not pd.isnull(response) else None
-                data_to_insert.append({'question_id': question_ids[question], 'response': response})
-                
-        # Insert responses in batches to optimize performance
-        if data_to_insert:
-            try:
-                conn.execute(text("""
-                INSERT INTO survey_responses (question_id, response)
-                VALUES (:question_id, :response)
-                """), data_to_insert)
-                data_to_insert = []  # Reset for next batch
-                logger.info(f"Responses for row {index+1} inserted.")
-            except SQLAlchemyError as e:
-                logger.error(f"Error inserting responses for row {index+1}: {e}")
+    """
+    Reshapes the question columns into (question_id, response) records in
+    row-major order and inserts them with a single executemany call.
+    """
+    if not question_ids:
+        return
+    responses = df[list(question_ids)]
+    responses = responses.astype(object).where(responses.notna(), None)
+    # Stack on the original column names; several columns may share a question id
+    records = (
+        responses.stack(future_stack=True)
+        .rename_axis(['row', 'question'])
+        .reset_index(level='question', name='response')
+    )
+    records['question_id'] = records['question'].map(question_ids)
+    data_to_insert = records[['question_id', 'response']].to_dict('records')
+
+    try:
+        conn.execute(text("""
+        INSERT INTO survey_responses (question_id, response)
+        VALUES (:question_id, :response)
+        """), data_to_insert)
+        logger.info("%d responses for %d rows inserted.", len(data_to_insert), len(df))
+    except SQLAlchemyError as e:
+        logger.error("Error inserting responses: %s", e)
+
+def read_sheet(sheet_name):
+    logger.info("Starting processing of sheet: %s", sheet_name)
+    try:
+        return pd.read_excel(excel_file, sheet_name=sheet_name, engine='calamine')
+    except Exception as e:
+        logger.error("Error reading sheet '%s': %s", sheet_name, e)
+        return None
+
+def load_sheet_responses(sheet_name, df, question_ids):
+    # Each worker runs in its own transaction on its own pooled connection
+    try:
+        with engine.begin() as conn:
+            insert_responses(df, question_ids, conn)
+        logger.info("Completed processing sheet: %s", sheet_name)
+    except Exception as e:
+        logger.error("Error processing sheet '%s': %s", sheet_name, e)
 
 with engine.begin() as conn:
     create_tables(conn)
-    xls = pd.ExcelFile(excel_file)
-    for sheet_name in xls.sheet_names:
-        logger.info(f"Starting processing of sheet: {sheet_name}")
-        try:
-            df = pd.read_excel(xls, sheet_name=sheet_name)
-            question_ids = insert_questions_get_ids(df, conn)
-            insert_responses(df, question_ids, conn)
-            logger.info(f"Completed processing sheet: {sheet_name}")
-        except Exception as e:
-            logger.error(f"Error processing sheet '{sheet_name}': {e}")
+
+sheet_names = pd.ExcelFile(excel_file, engine='calamine').sheet_names
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    sheets = {name: df for name, df in zip(sheet_names, executor.map(read_sheet, sheet_names)) if df is not None}
+
+    # Questions are inserted and committed serially so every sheet resolves its ids
+    # before the response inserts, which reference them, start in parallel
+    with engine.begin() as conn:
+        question_ids_by_sheet = {name: insert_questions_get_ids(df, conn) for name, df in sheets.items()}
+
+    list(executor.map(
+        load_sheet_responses,
+        sheets.keys(), sheets.values(), [question_ids_by_sheet[name] for name in sheets],
+    ))
@@ -1,113 +1,452 @@
 from dotenv import load_dotenv
 import streamlit as st
-from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_community.utilities import SQLDatabase
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from sqlalchemy import create_engine, make_url
 from sqlalchemy.exc import SQLAlchemyError
+from cachetools import LRUCache
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+import hashlib
+import logging
+import numpy as np
 import os
+import threading
+import tiktoken
+import unicodedata
+from preprocess import normalize_query
+from prompts import (
+    ANSWER_HUMAN_TEMPLATE,
+    ANSWER_SYSTEM_TEMPLATE,
+    SQL_SYSTEM_TEMPLATE,
+    SUMMARY_TEMPLATE,
+    format_query_result,
+    parse_sql_output,
+    prepare_sql_query,
+    render_response_template,
+    reserved_columns,
+    run_query,
+    run_with_quoted_retry,
+)
+
+DB_SETTINGS = ("DB_USER", "DB_PASSWORD", "DB_HOST", "DB_PORT", "DB_DATABASE")
+
+# Streamlit reruns the whole script on every interaction; .env only needs to be read once per process.
+# No spinner, since set_page_config below must still be the first command that renders anything
+@st.cache_resource(show_spinner=False)
+def load_settings() -> dict:
+    load_dotenv()
+    return {name: os.getenv(name) for name in DB_SETTINGS}
 
 # Initialize environment variables
-load_dotenv()
+settings = load_settings()
+
+# LOG_LEVEL=WARNING silences the per-turn logging in production
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
 
 # Set Streamlit page configuration
 st.set_page_config(page_title="Chat with MySQL", page_icon=":speech_balloon:")
 
 # Database connection settings (extracted from environment variables for security)
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_DATABASE = os.getenv("DB_DATABASE")
+DB_USER = settings["DB_USER"]
+DB_PASSWORD = settings["DB_PASSWORD"]
+DB_HOST = settings["DB_HOST"]
+DB_PORT = settings["DB_PORT"]
+DB_DATABASE = settings["DB_DATABASE"]
+
+# mysqlclient (C extension) decodes results much faster than the pure-Python drivers;
+# it needs the MySQL client libraries to build, so PyMySQL is the fallback
+try:
+    import MySQLdb  # noqa: F401
+    MYSQL_DRIVER = "mysqldb"
+except ImportError:
+    MYSQL_DRIVER = "pymysql"
 
 # Function to initialize database connection
 @st.cache_resource
 def init_database(user: str, password: str, host: str, port: str, database: str) -> SQLDatabase:
-    db_uri = f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
-    return SQLDatabase.from_uri(db_uri)
+    db_uri = f"mysql+{MYSQL_DRIVER}://{user}:{password}@{host}:{port}/{database}?charset=utf8mb4"
+    logger.info("Connecting to %s", make_url(db_uri).render_as_string(hide_password=True))
+    # Keep a warm, validated pool: pre-ping replaces stale sockets and recycling stays under MySQL's wait_timeout
+    engine = create_engine(
+        db_uri,
+        pool_size=5,
+        max_overflow=5,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        pool_timeout=10,
+        # Fail fast instead of hanging a session when MySQL is unreachable
+        connect_args={"connect_timeout": 10},
+    )
+    return SQLDatabase(engine)
 
 # Attempt to establish the database connection
 db = init_database(DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_DATABASE)
 if db is not None:
     st.success("Connected to database!")
 
-def get_sql_chain(db):
-    template = """
-    You are a data analyst in a tourism company. Your task involves handling queries about the tourism articles database. This database consists of detailed entries about various articles, each entry encompassing data such as article titles, URLs, domains, sentiments, and more detailed categorizations. Your role is to assist users by retrieving specific information based on their queries related to these articles.
+# Reflecting the schema costs several information_schema queries; reuse it for ten minutes
+@st.cache_data(ttl=600)
+def get_schema(_db: SQLDatabase) -> str:
+    # Stripped so the prompt prefix stays byte-identical between turns
+    return _db.get_table_info().strip()
 
-    The database structure includes a table 'tourism_data' that captures each article's comprehensive details. Your task is to formulate SQL queries that precisely fetch the data as per the user's request.
+# Cached so the OpenAI client and its connection pool survive Streamlit reruns
+@st.cache_resource
+def get_llm() -> ChatOpenAI:
+    # gpt-4o applies OpenAI's automatic prompt caching to repeated prefixes
+    return ChatOpenAI(model="gpt-4o")
 
-    Based on the table schema below and the conversation history, write a SQL query to answer the user's question.
+# SQL generation on one known table is routine; a small deterministic model is enough
+@st.cache_resource
+def get_sql_llm() -> ChatOpenAI:
+    return ChatOpenAI(model="gpt-4o-mini", temperature=0)
 
-    <SCHEMA>{schema}</SCHEMA>
+# The schema is bound as a partial that reads the cached string, so callers only
+# pass the per-turn fields and a schema refresh is picked up without a rebuild
+@st.cache_resource
+def get_sql_chain(_db: SQLDatabase):
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SQL_SYSTEM_TEMPLATE),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{question}"),
+    ]).partial(schema=lambda: get_schema(_db))
 
-    Conversation History: {chat_history}
+    return (
+        prompt
+        | get_sql_llm().bind(response_format={"type": "json_object"})
+        | StrOutputParser()
+        | parse_sql_output
+    )
 
-    Write only the SQL query and nothing else. Do not wrap the SQL query in any other text, not even backticks.
+# At most this many result rows are passed on to the answer prompt
+MAX_RESULT_ROWS = 50
 
-    For example:
-    Question: How many articles mentioned 'sustainability' last month?
-    SQL Query: SELECT COUNT(*) FROM tourism_data WHERE topics LIKE '%sustainability%' AND publish_date >= DATE_SUB(NOW(), INTERVAL 1 MONTH);
-    """
-    prompt = ChatPromptTemplate.from_template(template)
-    llm = ChatOpenAI(model="gpt-4-turbo-preview")
+def trivial_response(rows: list) -> Optional[str]:
+    """Answers empty and single-value results directly, or returns None."""
+    # A lone NULL is what SUM, AVG or MAX return when no rows match
+    if not rows or (len(rows) == 1 and len(rows[0]) == 1 and rows[0][0] is None):
+        return "No se encontraron resultados para tu pregunta."
+    if len(rows) == 1 and len(rows[0]) == 1:
+        return f"El resultado es: {rows[0][0]}."
+    return None
+
+# Identical SQL is often generated for the same questions; reuse its result for a minute
+@st.cache_data(ttl=60, max_entries=256, show_spinner=False)
+def run_cached_query(_db: SQLDatabase, query: str) -> tuple:
+    return run_query(_db, query, MAX_RESULT_ROWS)
 
-    def get_schema(_):
-        return db.get_table_info()
+# Result -> Spanish answer; this is the part streamed to the user
+@st.cache_resource
+def get_answer_chain(_db: SQLDatabase):
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", ANSWER_SYSTEM_TEMPLATE),
+        MessagesPlaceholder("chat_history"),
+        ("human", ANSWER_HUMAN_TEMPLATE),
+    ]).partial(schema=lambda: get_schema(_db))
 
     return (
-        RunnablePassthrough.assign(schema=get_schema)
-        | prompt
-        | llm
+        prompt
+        | get_llm()
         | StrOutputParser()
     )
 
-def get_response(user_query: str, db: SQLDatabase, chat_history: list):
-    sql_chain = get_sql_chain(db)
-    template = """
-    As a data analyst, you are tasked with translating complex database queries into natural language answers that are easy to understand. Here, the user is inquiring about specific tourism-related data stored in our 'tourism_data' table.
+# Minimum cosine similarity for a new question to reuse a cached answer
+SEMANTIC_CACHE_THRESHOLD = 0.92
+# Number of (history, question) pairs remembered verbatim
+EXACT_CACHE_SIZE = 1024
+# Number of embedded questions kept; the least recently used is replaced once full
+SEMANTIC_CACHE_SIZE = 1024
+
+def history_key(chat_history: list) -> str:
+    # Both cache layers match on the recent turns, so a follow-up only matches in the same context
+    recent = "\x1f".join(message.content for message in chat_history[-RECENT_MESSAGES:])
+    return hashlib.blake2b(recent.encode("utf-8"), digest_size=16).hexdigest()
+
+def exact_cache_key(user_query: str, history_hash: str, schema_hash: str) -> str:
+    # Only case, Unicode form and spacing are ignored; any other character may change the answer
+    question = " ".join(unicodedata.normalize("NFC", user_query).casefold().split())
+    key = f"{schema_hash}|{history_hash}|{question}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
 
-    Based on the table schema, the user's question, the SQL query you formulated, and the database's response, craft a response in Spanish that accurately and effectively communicates the needed information.
+class SemanticCache:
+    """
+    Keeps previous answers indexed by the embedding of their normalized question,
+    so paraphrases of a question already answered skip the LLM calls and the SQL
+    round trip. Every entry is tied to the schema it was answered against and
+    only matches questions asked after the same recent history, so a follow-up
+    like "¿y el mes pasado?" isn't answered from another conversation.
 
-    <SCHEMA>{schema}</SCHEMA>
+    An exact layer in front, keyed on the question and the recent history,
+    answers verbatim repeats without waiting for the embedding.
+    """
 
-    Conversation History: {chat_history}
-    SQL Query: <SQL>{query}</SQL>
-    User question: {question}
-    SQL Response: {response}"""
+    def __init__(self, embeddings: OpenAIEmbeddings, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 size: int = SEMANTIC_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.size = size
+        self._lock = threading.Lock()
+        self._schema_hash = None
+        # Preallocated on the first add (one unit-length row per slot), so adding never copies it
+        self._vectors = None
+        self._responses = [None] * size
+        self._history_keys = np.full(size, None, dtype=object)
+        self._last_used = np.zeros(size, dtype=np.int64)
+        self._clock = 0
+        self._count = 0
+        self._exact = LRUCache(maxsize=EXACT_CACHE_SIZE)
 
-    prompt = ChatPromptTemplate.from_template(template)
-    llm = ChatOpenAI(model="gpt-4-turbo-preview")
+    def embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(normalize_query(query)), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
 
-    chain = (
-        RunnablePassthrough.assign(query=sql_chain).assign(
-            schema=lambda _: db.get_table_info(),
-            response=lambda vars: db.run(vars["query"]),
-        )
-        | prompt
-        | llm
+    def _reset_if_schema_changed(self, schema_hash: str):
+        # Answers computed against an older schema can no longer be trusted
+        if schema_hash != self._schema_hash:
+            self._schema_hash = schema_hash
+            self._responses = [None] * self.size
+            self._history_keys[:] = None
+            self._count = 0
+            self._exact.clear()
+
+    def lookup_exact(self, key: str, schema_hash: str) -> Optional[str]:
+        with self._lock:
+            self._reset_if_schema_changed(schema_hash)
+            return self._exact.get(key)
+
+    def lookup(self, vector: np.ndarray, history_hash: str, schema_hash: str) -> Optional[str]:
+        with self._lock:
+            self._reset_if_schema_changed(schema_hash)
+            if self._count == 0:
+                return None
+            # Vectors are normalized, so the dot product is the cosine similarity
+            scores = self._vectors[:self._count] @ vector
+            scores[self._history_keys[:self._count] != history_hash] = -1
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            self._clock += 1
+            self._last_used[best] = self._clock
+            return self._responses[best]
+
+    def add(self, key: str, vector: Optional[np.ndarray], history_hash: str, schema_hash: str, response: str):
+        with self._lock:
+            self._reset_if_schema_changed(schema_hash)
+            self._exact[key] = response
+            if vector is None:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros((self.size, vector.shape[0]), dtype=np.float32)
+            if self._count < self.size:
+                slot = self._count
+                self._count += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._vectors[slot] = vector
+            self._responses[slot] = response
+            self._history_keys[slot] = history_hash
+            self._clock += 1
+            self._last_used[slot] = self._clock
+
+# Shared by every session so one user's answers can serve another's paraphrases
+@st.cache_resource
+def get_semantic_cache() -> SemanticCache:
+    return SemanticCache(OpenAIEmbeddings(model="text-embedding-3-small"))
+
+# Shared pool for the independent I/O-bound steps of a turn
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=8)
+
+# The last two question/answer turns are always sent verbatim
+RECENT_MESSAGES = 4
+# Older messages are folded into the running summary once this many have piled up
+SUMMARY_BATCH = 4
+# Hard cap on the history's size, so a few very long answers can't blow up the prompt
+MAX_HISTORY_TOKENS = 2000
+
+# tiktoken 0.6 predates gpt-4o's o200k_base; cl100k_base is a close enough count for a budget
+@st.cache_resource
+def get_token_encoding() -> Optional[tiktoken.Encoding]:
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The encoding file is downloaded on first use; without it, fall back to an estimate
+        logger.warning("Token encoding unavailable, estimating history size: %s", e)
+        return None
+
+def count_tokens(content: str) -> int:
+    encoding = get_token_encoding()
+    if encoding is None:
+        return len(content) // 4 + 1
+    return len(encoding.encode(content, disallowed_special=()))
+
+def trim_to_token_budget(messages: list, max_tokens: int = MAX_HISTORY_TOKENS) -> list:
+    """
+    Keeps the newest messages that fit in max_tokens, dropping older ones first.
+    A message that alone exceeds the remaining budget ends the history there.
+    """
+    kept = []
+    remaining = max_tokens
+    for message in reversed(messages):
+        tokens = count_tokens(message.content)
+        if tokens > remaining:
+            break
+        kept.append(message)
+        remaining -= tokens
+    kept.reverse()
+    return kept
+
+# A small, cheap model is enough to condense the older turns
+@st.cache_resource
+def get_summary_chain():
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SUMMARY_TEMPLATE),
+        MessagesPlaceholder("messages"),
+        ("human", "Write the updated summary."),
+    ])
+
+    return (
+        prompt
+        | ChatOpenAI(model="gpt-4o-mini", temperature=0, max_tokens=200)
         | StrOutputParser()
     )
 
+def summarize_history(summary_chain, summary: str, messages: list, summarized_count: int) -> tuple:
+    new_summary = summary_chain.invoke({"summary": summary or "(empty)", "messages": messages})
+    return new_summary, summarized_count
+
+def get_prompt_history(chat_history: list) -> list:
+    """
+    Returns the history to send with a new question: a running summary of the
+    older turns followed by the recent messages, so the prompt stays bounded
+    however long the conversation gets.
+    """
+    if "history_summary" not in st.session_state:
+        st.session_state.history_summary = ""
+        st.session_state.summarized_count = 0
+        st.session_state.summary_future = None
+
+    # Apply a summary refresh that finished in the background since the last turn
+    pending = st.session_state.summary_future
+    if pending is not None and pending.done():
+        st.session_state.summary_future = None
+        try:
+            st.session_state.history_summary, st.session_state.summarized_count = pending.result()
+        except Exception as e:
+            logger.warning("Could not refresh the history summary: %s", e)
+
+    # Once enough messages have aged out of the recent window, summarize them on the pool.
+    # The SQL call doesn't wait for it: until it lands, those messages are sent verbatim.
+    older_count = max(len(chat_history) - RECENT_MESSAGES, 0)
+    if (st.session_state.summary_future is None
+            and older_count - st.session_state.summarized_count >= SUMMARY_BATCH):
+        st.session_state.summary_future = get_executor().submit(
+            summarize_history,
+            get_summary_chain(),
+            st.session_state.history_summary,
+            chat_history[st.session_state.summarized_count:older_count],
+            older_count,
+        )
+
+    messages = chat_history[st.session_state.summarized_count:]
+    if st.session_state.history_summary:
+        summary = SystemMessage(content="Summary of the earlier conversation: " + st.session_state.history_summary)
+        messages = [summary] + messages
+    return trim_to_token_budget(messages)
+
+# A slow or failing embedding call skips the semantic cache instead of holding up the answer
+EMBEDDING_TIMEOUT = 1.0
+
+def wait_for_embedding(future: Future, timeout: float) -> Optional[np.ndarray]:
     try:
-        # Execute the chain to process and handle the query
-        response = chain.invoke({
+        return future.result(timeout=timeout)
+    except Exception:
+        return None
+
+def get_response(user_query: str, db: SQLDatabase, chat_history: list):
+    """
+    Yields the answer in chunks as the LLM generates it, so it can be passed
+    straight to st.write_stream.
+    """
+    cache = get_semantic_cache()
+
+    try:
+        # The schema reflection (MySQL) and the question embedding (OpenAI) don't
+        # depend on each other, so both round trips run at the same time
+        vector_future = get_executor().submit(cache.embed, user_query)
+        # Cached answers are only valid for the schema they were computed against
+        schema = get_schema(db)
+        schema_hash = hashlib.sha256(schema.encode("utf-8")).hexdigest()
+
+        history_hash = history_key(chat_history)
+        exact_key = exact_cache_key(user_query, history_hash, schema_hash)
+        cached_response = cache.lookup_exact(exact_key, schema_hash)
+        if cached_response is not None:
+            vector_future.cancel()
+            yield cached_response
+            return
+
+        query_vector = wait_for_embedding(vector_future, EMBEDDING_TIMEOUT)
+        if query_vector is not None:
+            cached_response = cache.lookup(query_vector, history_hash, schema_hash)
+            if cached_response is not None:
+                yield cached_response
+                return
+
+        # Generate and run the SQL, then stream the answer as it is written
+        inputs = {
             "question": user_query,
-            "chat_history": chat_history,
-        })
-        return response
+            "chat_history": get_prompt_history(chat_history),
+        }
+        inputs["query"], response_template = get_sql_chain(db).invoke(inputs)
+        logger.info("Generated SQL: %s", inputs["query"])
+        # Only a single read-only SELECT reaches the database, capped one row past what is shown so
+        # truncation is still detected; if MySQL rejects it, it is retried with reserved columns quoted
+        inputs["query"], (rows, truncated) = run_with_quoted_retry(
+            lambda sql: run_cached_query(db, prepare_sql_query(sql, MAX_RESULT_ROWS + 1)),
+            inputs["query"],
+            reserved_columns(schema),
+        )
+
+        # A complete, non-empty result can fill the model's own template and skip the answer call;
+        # empty and single-value results don't need the model either
+        response = None
+        if rows and not truncated:
+            response = render_response_template(response_template, rows)
+        if response is None:
+            response = trivial_response(rows)
+        if response is not None:
+            chunks = [response]
+            yield response
+        else:
+            inputs["response"] = format_query_result(rows, truncated)
+            chunks = []
+            for chunk in get_answer_chain(db).stream(inputs):
+                chunks.append(chunk)
+                yield chunk
+        # An embedding that missed the deadline has usually arrived by now
+        query_vector = wait_for_embedding(vector_future, 0)
+        cache.add(exact_key, query_vector, history_hash, schema_hash, "".join(chunks))
     except SQLAlchemyError as e:
         # Handle SQL execution errors
         error_message = "An error occurred while processing your query: " + str(e)
         st.error(error_message)
-        return "An error occurred while processing your query. Please check the query and try again."
+        yield "An error occurred while processing your query. Please check the query and try again."
+    except ValueError as e:
+        # No usable SQL came back, or it failed the read-only check; nothing was run
+        st.error("The generated query was rejected: " + str(e))
+        yield "I couldn't build a valid read-only query for that question. Please rephrase it."
     except Exception as e:
         # Handle other types of errors
         error_message = "An unexpected error occurred: " + str(e)
         st.error(error_message)
-        return "An unexpected error occurred. Please try again later."
+        yield "An unexpected error occurred. Please try again later."
     
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = [
@@ -116,8 +455,41 @@ if "chat_history" not in st.session_state:
 
 st.title("Chat with MySQL")
 
+# The schema is cached for ten minutes; after a DDL change it can be reloaded right away
+with st.sidebar:
+    if st.button("Refresh schema", help="Reload the table structure from the database"):
+        get_schema.clear()
+        get_schema(db)
+        st.toast("Schema reloaded.")
+
+# Only the most recent messages are rendered on each rerun; older ones on request
+VISIBLE_MESSAGES = 20
+
+def get_earlier_transcript(chat_history: list, count: int) -> str:
+    """
+    Returns the first count messages as one markdown string. The formatted
+    messages are kept in the session, so only those that scrolled out since
+    the last call are formatted.
+    """
+    if "earlier_transcript" not in st.session_state:
+        st.session_state.earlier_transcript = []
+    transcript = st.session_state.earlier_transcript
+    for message in chat_history[len(transcript):count]:
+        role = "AI" if isinstance(message, AIMessage) else "Human"
+        transcript.append(f"**{role}:** {message.content}")
+    return "\n\n---\n\n".join(transcript)
+
 # Chat interface to display messages and handle user input
-for message in st.session_state.chat_history:
+visible_history = st.session_state.chat_history
+hidden_count = len(visible_history) - VISIBLE_MESSAGES
+if hidden_count > 0:
+    visible_history = visible_history[hidden_count:]
+    # The earlier messages are a single element instead of one chat message each
+    # The label is part of the widget's identity, so it stays fixed or the toggle would reset every turn
+    if st.toggle("Show earlier messages"):
+        st.markdown(get_earlier_transcript(st.session_state.chat_history, hidden_count))
+
+for message in visible_history:
     if isinstance(message, AIMessage):
         with st.chat_message("AI"):
             st.markdown(message.content)
@@ -132,9 +504,8 @@ if user_query is not None and user_query.strip() != "":
     with st.chat_message("Human"):
         st.markdown(user_query)
 
-    response = get_response(user_query, db, st.session_state.chat_history)
-    
     with st.chat_message("AI"):
-        st.markdown(response)
+        # The new question is sent as its own message after the earlier history
+        response = st.write_stream(get_response(user_query, db, st.session_state.chat_history[:-1]))
 
     st.session_state.chat_history.append(AIMessage(content=response))
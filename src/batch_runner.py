@@ -0,0 +1,166 @@
+"""
+Answers a file of questions offline through the OpenAI Batch API, at half the
+price of the interactive path. Each question goes through the same two steps
+as the chat app: one batch generates the SQL, the queries run locally, and a
+second batch writes the Spanish answers.
+
+Input lines look like {"id": "...", "question": "..."}; output lines add
+"sql" and "response".
+"""
+import json
+import logging
+import os
+import time
+
+from dotenv import load_dotenv
+from langchain_community.utilities import SQLDatabase
+from openai import OpenAI
+from sqlalchemy.exc import SQLAlchemyError
+
+from preprocess import normalize_query
+from prompts import (
+    ANSWER_HUMAN_TEMPLATE,
+    ANSWER_SYSTEM_TEMPLATE,
+    SQL_SYSTEM_TEMPLATE,
+    format_query_result,
+    parse_sql_output,
+    prepare_sql_query,
+    reserved_columns,
+    run_query,
+    run_with_quoted_retry,
+)
+
+load_dotenv()
+
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger(__name__)
+
+# Database connection details from environment variables
+username = os.getenv('DB_USER')
+password = os.getenv('DB_PASSWORD')
+host = os.getenv('DB_HOST')
+port = os.getenv('DB_PORT')
+database = os.getenv('DB_DATABASE')
+
+QUERIES_FILE = 'queries.jsonl'
+OUTPUT_FILE = 'queries_answered.jsonl'
+
+SQL_MODEL = 'gpt-4o-mini'
+ANSWER_MODEL = 'gpt-4o'
+
+# Rows of each result that go into the answer prompt
+MAX_RESULT_ROWS = 100
+
+POLL_INTERVAL = 60  # seconds between status checks; batches take minutes to hours
+FINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+def read_queries(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def chat_request(custom_id, model, messages, **options):
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {'model': model, 'messages': messages, **options},
+    }
+
+def run_batch(client, name, requests):
+    """Submits the requests as one batch, waits for it and returns the message content by custom_id."""
+    payload = '\n'.join(json.dumps(request, ensure_ascii=False) for request in requests)
+    input_file = client.files.create(file=(f'{name}.jsonl', payload.encode('utf-8')), purpose='batch')
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint='/v1/chat/completions',
+        completion_window='24h',
+    )
+    logger.info("Submitted batch %s with %d %s requests.", batch.id, len(requests), name)
+
+    while batch.status not in FINAL_STATUSES:
+        time.sleep(POLL_INTERVAL)
+        batch = client.batches.retrieve(batch.id)
+        logger.info("Batch %s: %s (%d/%d)", batch.id, batch.status,
+                    batch.request_counts.completed, batch.request_counts.total)
+
+    if batch.status != 'completed' or batch.output_file_id is None:
+        raise RuntimeError(f"Batch {batch.id} ended with status '{batch.status}'")
+
+    contents = {}
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        result = json.loads(line)
+        if result.get('error') or result['response']['status_code'] != 200:
+            logger.error("Request %s failed: %s", result['custom_id'], result.get('error') or result['response']['body'])
+            continue
+        contents[result['custom_id']] = result['response']['body']['choices'][0]['message']['content']
+    return contents
+
+def run_sql(db, query, columns):
+    """Returns the SQL that ran, which may have its reserved columns quoted, and its result or the error."""
+    try:
+        # The LIMIT only covers queries the model wrote without one; the fetch caps the rest
+        query, (rows, truncated) = run_with_quoted_retry(
+            lambda sql: run_query(db, prepare_sql_query(sql, MAX_RESULT_ROWS + 1), MAX_RESULT_ROWS),
+            query,
+            columns,
+        )
+        return query, format_query_result(rows, truncated)
+    except (ValueError, SQLAlchemyError) as e:
+        logger.error("Error running query '%s': %s", query, e)
+        return query, f"Error: {e}"
+
+if __name__ == '__main__':
+    client = OpenAI()
+    db = SQLDatabase.from_uri(f"mysql+pymysql://{username}:{password}@{host}:{port}/{database}?charset=utf8mb4")
+    schema = db.get_table_info().strip()
+    queries = read_queries(QUERIES_FILE)
+    # Questions that only differ in case, Unicode form, punctuation or spacing are sent once
+    representatives = {}
+    for query in queries:
+        representatives.setdefault(normalize_query(query['question']), query)
+    unique_queries = list(representatives.values())
+    logger.info("%d unique questions out of %d.", len(unique_queries), len(queries))
+
+    # Step 1: question -> SQL
+    sql_system = SQL_SYSTEM_TEMPLATE.format(schema=schema)
+    sql_by_id = run_batch(client, 'sql', [
+        chat_request(str(query['id']), SQL_MODEL, [
+            {'role': 'system', 'content': sql_system},
+            {'role': 'user', 'content': query['question']},
+        ], response_format={'type': 'json_object'})
+        for query in unique_queries
+    ])
+    for query_id, content in list(sql_by_id.items()):
+        try:
+            # The response template is for the interactive path; here every answer goes through the batch
+            sql_by_id[query_id], _ = parse_sql_output(content)
+        except ValueError as e:
+            logger.error("Request %s: %s", query_id, e)
+            del sql_by_id[query_id]
+
+    # Step 2: run the queries locally
+    columns = reserved_columns(schema)
+    result_by_id = {}
+    for query_id, sql in sql_by_id.items():
+        sql_by_id[query_id], result_by_id[query_id] = run_sql(db, sql, columns)
+
+    # Step 3: SQL result -> Spanish answer
+    answer_system = ANSWER_SYSTEM_TEMPLATE.format(schema=schema)
+    response_by_id = run_batch(client, 'answer', [
+        chat_request(str(query['id']), ANSWER_MODEL, [
+            {'role': 'system', 'content': answer_system},
+            {'role': 'user', 'content': ANSWER_HUMAN_TEMPLATE.format(
+                query=sql_by_id[str(query['id'])],
+                question=query['question'],
+                response=result_by_id[str(query['id'])],
+            )},
+        ])
+        for query in unique_queries if str(query['id']) in sql_by_id
+    ])
+
+    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        for query in queries:
+            query_id = str(representatives[normalize_query(query['question'])]['id'])
+            record = dict(query, sql=sql_by_id.get(query_id), response=response_by_id.get(query_id))
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    logger.info("Wrote answers for %d questions to %s.", len(queries), OUTPUT_FILE)
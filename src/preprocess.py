@@ -0,0 +1,21 @@
+"""
+Text normalization for user questions, shared by the semantic cache and the
+batch runner so both treat trivially different phrasings as the same question.
+"""
+import re
+import unicodedata
+
+# Only sentence punctuation is dropped: question and exclamation marks anywhere, and periods,
+# commas, colons and semicolons that end a word. Comparison operators, signs, '%', decimal
+# points and date separators change what is being asked, so they stay.
+_SENTENCE_PUNCTUATION = re.compile(r"[?¿!¡]|[.,;:]+(?=\s|$)")
+
+def normalize_query(query: str) -> str:
+    """
+    Returns the question in NFC form, case-folded, without sentence
+    punctuation and with runs of whitespace collapsed to single spaces. Uses
+    only C-implemented str and re methods, so it is cheap enough to run over
+    large batches of questions.
+    """
+    query = unicodedata.normalize("NFC", query).casefold()
+    return " ".join(_SENTENCE_PUNCTUATION.sub("", query).split())
@@ -0,0 +1,350 @@
+"""
+Prompt templates shared by the chat app and the offline batch runner, the
+helpers that turn the SQL prompt's output into a query that is safe to run,
+and the capped fetch that turns its result into the answer prompt's input.
+"""
+import json
+import re
+import string
+from typing import Optional
+
+from jinja2 import StrictUndefined
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+# Example (question, SQL, response template) triples that anchor the small SQL model;
+# they are part of the cached prefix
+FEW_SHOTS = [
+    (
+        "How many articles mentioned 'sustainability' last month?",
+        "SELECT COUNT(*) FROM tourism_data WHERE topics LIKE '%sustainability%' AND publish_date >= DATE_SUB(NOW(), INTERVAL 1 MONTH);",
+        "El último mes se publicaron {{ rows[0][0] }} artículos que mencionan la sostenibilidad.",
+    ),
+    (
+        "Which domains published the most articles?",
+        "SELECT domain, COUNT(*) AS articles FROM tourism_data GROUP BY domain ORDER BY articles DESC LIMIT 10;",
+        "Los dominios con más artículos son: {% for domain, articles in rows %}{{ domain }} ({{ articles }}){% if not loop.last %}, {% endif %}{% endfor %}.",
+    ),
+    (
+        "How are the articles split by sentiment?",
+        "SELECT sentiment, COUNT(*) AS articles FROM tourism_data GROUP BY sentiment;",
+        "Reparto de los artículos por sentimiento: {% for sentiment, articles in rows %}{{ sentiment }}: {{ articles }}{% if not loop.last %}; {% endif %}{% endfor %}.",
+    ),
+    (
+        "Show me the titles and URLs of the five most recent articles.",
+        "SELECT title, url FROM tourism_data ORDER BY publish_date DESC LIMIT 5;",
+        "",
+    ),
+]
+
+# Each prompt is split into an invariant system prefix (instructions + schema) followed by
+# the conversation, so the provider can reuse its prompt cache for the prefix across turns
+SQL_SYSTEM_TEMPLATE = """
+    You are a data analyst in a tourism company. Your task involves handling queries about the tourism articles database. This database consists of detailed entries about various articles, each entry encompassing data such as article titles, URLs, domains, sentiments, and more detailed categorizations. Your role is to assist users by retrieving specific information based on their queries related to these articles.
+
+    The database structure includes a table 'tourism_data' that captures each article's comprehensive details. Your task is to formulate SQL queries that precisely fetch the data as per the user's request.
+
+    Reply with a JSON object of the form {{"sql": "<query>", "response_template": "<template>"}} and nothing else, where <query> is a single MySQL query.
+
+    <template> is a short answer in Spanish written as a Jinja2 template, which is filled in with the query's result: `rows` is the list of result rows, each a list of the selected values in order. Only write a template when the answer is a direct statement of the values; leave it empty when the rows need interpretation or summarizing.
+
+    For example:
+{few_shots}
+
+    The examples only illustrate the style; always use the column names from the schema.
+
+    Based on the table schema below and the conversation history, write a SQL query to answer the user's question.
+
+    <SCHEMA>{schema}</SCHEMA>
+    """.replace("{few_shots}", "\n\n".join(
+    # Braces are doubled so the JSON survives template formatting
+    f"    Question: {question}\n    Reply: "
+    + json.dumps({"sql": sql, "response_template": template}, ensure_ascii=False).replace("{", "{{").replace("}", "}}")
+    for question, sql, template in FEW_SHOTS
+))
+
+ANSWER_SYSTEM_TEMPLATE = """
+    As a data analyst, you are tasked with translating complex database queries into natural language answers that are easy to understand. Here, the user is inquiring about specific tourism-related data stored in our 'tourism_data' table.
+
+    Based on the table schema, the conversation history, the user's question, the SQL query you formulated, and the database's response, craft a response in Spanish that accurately and effectively communicates the needed information.
+
+    <SCHEMA>{schema}</SCHEMA>
+    """
+
+ANSWER_HUMAN_TEMPLATE = """
+    SQL Query: <SQL>{query}</SQL>
+    User question: {question}
+    SQL Response: {response}"""
+
+SUMMARY_TEMPLATE = """
+    You maintain a running summary of a conversation between a user and a data analyst who answers questions about the 'tourism_data' table.
+
+    Update the current summary with the new messages below. Keep the filters, dates, entities and figures the user may refer back to, and drop everything else. Use at most 150 words.
+
+    Current summary: {summary}
+    """
+
+def parse_sql_output(content: str) -> tuple:
+    """
+    Extracts the query and the (possibly empty) response template from the SQL
+    prompt's JSON reply. Raises ValueError if the reply doesn't contain a query.
+    """
+    try:
+        output = json.loads(content)
+        query = output["sql"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("The model did not return a SQL query.")
+    if not isinstance(query, str) or not query.strip():
+        raise ValueError("The model did not return a SQL query.")
+    template = output.get("response_template")
+    return query.strip(), template.strip() if isinstance(template, str) else ""
+
+def _reject_null(value):
+    # Python's None would end up in the Spanish answer; NULLs need the answer prompt instead
+    if value is None:
+        raise ValueError("NULL value in the result")
+    return value
+
+# Templates come from the model, so they render in a sandbox and fail loudly on missing values
+_TEMPLATE_ENV = ImmutableSandboxedEnvironment(undefined=StrictUndefined, autoescape=False, finalize=_reject_null)
+
+def render_response_template(template: str, rows: list):
+    """
+    Fills the model's response template with the result rows. Returns None when
+    there is no template or it can't be rendered, so the caller falls back to
+    the answer prompt.
+    """
+    if not template:
+        return None
+    try:
+        response = _TEMPLATE_ENV.from_string(template).render(rows=[list(row) for row in rows])
+    except Exception:
+        return None
+    return response.strip() or None
+
+# Keywords that write data or files, and functions that read server files or stall the
+# connection; none of them belongs in a read-only query
+FORBIDDEN_KEYWORDS = frozenset({
+    "insert", "update", "delete", "drop", "alter", "create", "truncate",
+    "grant", "revoke", "rename", "outfile", "dumpfile",
+    "load_file", "sleep", "benchmark",
+})
+
+QUOTES = "'\"`"
+
+# Kinds of segment yielded by split_sql
+CODE = "code"
+QUOTED = "quoted"
+COMMENT = "comment"
+
+# Maps every ASCII punctuation character except '_' to a space, leaving identifiers and keywords
+_WORD_SEPARATORS = str.maketrans({c: " " for c in string.punctuation if c != "_"})
+
+def find_line_comment(query: str, start: int) -> int:
+    """Returns the position of the next '-- ' comment from start, or -1."""
+    # MySQL only starts a comment when the dashes are followed by whitespace; 5--3 is arithmetic
+    while (i := query.find("--", start)) >= 0:
+        if i + 2 == len(query) or query[i + 2].isspace():
+            return i
+        start = i + 1
+    return -1
+
+# Characters and sequences that open a literal, a quoted identifier or a comment
+_OPENERS = tuple(QUOTES) + ("#", "/*", "--")
+
+def find_opener(query: str, opener: str, start: int) -> int:
+    """Returns the position of the next occurrence of opener from start, or -1."""
+    if opener == "--":
+        return find_line_comment(query, start)
+    return query.find(opener, start)
+
+def split_sql(query: str):
+    """
+    Yields (text, kind) segments of the query. QUOTED segments are string
+    literals or quoted identifiers and COMMENT segments are comments; both are
+    left alone by the checks, and quotes inside comments don't open literals.
+    Jumps between quotes and comment markers with str.find instead of
+    visiting every character in Python. Each marker's next position is kept
+    and only searched again once the scan has passed it, so no part of the
+    query is searched twice for the same marker and the split stays linear.
+    """
+    start = 0
+    length = len(query)
+    positions = {opener: find_opener(query, opener, 0) for opener in _OPENERS}
+    while True:
+        for opener, position in positions.items():
+            if 0 <= position < start:
+                positions[opener] = find_opener(query, opener, start)
+        found = [position for position in positions.values() if position >= 0]
+        if not found:
+            break
+        i = min(found)
+        if start < i:
+            yield query[start:i], CODE
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            end = length if end < 0 else end + 2  # Unterminated; the rest of the query is the comment
+            yield query[i:end], COMMENT
+            start = end
+            continue
+        if query[i] in "#-":
+            # Line comments end before the newline, which stays in the code
+            end = query.find("\n", i)
+            end = length if end < 0 else end
+            yield query[i:end], COMMENT
+            start = end
+            continue
+        quote = query[i]
+        end = i + 1
+        while True:
+            end = query.find(quote, end)
+            if end < 0:
+                end = length  # Unterminated; the rest of the query is the literal
+                break
+            # Backslash escapes apply to string literals, not to backtick identifiers
+            if quote != "`":
+                backslashes = 0
+                while query[end - 1 - backslashes] == "\\":  # Stops at the opening quote at the latest
+                    backslashes += 1
+                if backslashes % 2:
+                    end += 1
+                    continue
+            if query[end + 1:end + 2] == quote:
+                end += 2  # Doubled quote inside the literal
+                continue
+            break
+        yield query[i:end + 1], QUOTED
+        start = end + 1
+    if start < length:
+        yield query[start:], CODE
+
+# Column definitions that the reflected CREATE TABLE had to backtick, i.e. names that are
+# reserved words in MySQL; names with spaces can't appear bare in a query and are left out
+_QUOTED_COLUMN = re.compile(r"^\s+`([A-Za-z_][A-Za-z0-9_$]*)` ", re.MULTILINE)
+# A bare identifier, and whether a call parenthesis or BY follows it (ORDER BY, GROUP BY)
+_IDENTIFIER = re.compile(r"(?<![\w$])([A-Za-z_][A-Za-z0-9_$]*)(\s*\(|\s+(?i:by)(?![\w$]))?")
+
+def reserved_columns(schema: str) -> frozenset:
+    """Returns the column names in the schema that MySQL only accepts quoted."""
+    return frozenset(_QUOTED_COLUMN.findall(schema))
+
+def quote_reserved_columns(query: str, columns: frozenset) -> str:
+    """
+    Backticks the reserved-word columns the model left bare, which MySQL
+    rejects as a syntax error. Names are matched with the schema's spelling,
+    a name followed by a parenthesis is taken as a function call (RANK()) and
+    one followed by BY as the clause keyword. A lower-case keyword elsewhere
+    can still be mistaken for the column, so callers only try this after
+    MySQL has rejected the query as generated.
+    """
+    if not columns:
+        return query
+
+    def quote(match):
+        name, keyword_follows = match.groups()
+        if keyword_follows or name not in columns:
+            return match.group(0)
+        return f"`{name}`"
+
+    return "".join(
+        _IDENTIFIER.sub(quote, segment) if kind == CODE else segment
+        for segment, kind in split_sql(query)
+    )
+
+def run_with_quoted_retry(run, query: str, columns: frozenset) -> tuple:
+    """
+    Calls run(query) and, if the database rejects it, tries once more with the
+    reserved-word columns quoted. Returns the query that ran and its result;
+    when quoting changes nothing, the original error is raised.
+    """
+    try:
+        return query, run(query)
+    except SQLAlchemyError:
+        repaired = quote_reserved_columns(query, columns)
+        if repaired == query:
+            raise
+        return repaired, run(repaired)
+
+def prepare_sql_query(query: str, max_rows: Optional[int] = None) -> str:
+    """
+    Checks that the query is a single read-only SELECT and returns it in a
+    canonical form (comments removed, whitespace outside literals collapsed,
+    no trailing semicolon) that identical queries share. With max_rows, a query without
+    a LIMIT gets one, so MySQL stops after the rows the caller will read.
+
+    Raises ValueError for anything else.
+    """
+    # Comments are dropped, so a line comment can't swallow what follows once newlines are
+    # collapsed; MySQL runs the body of /*! */ comments, so those are refused outright
+    segments = []
+    for segment, kind in split_sql(query.strip()):
+        if kind == COMMENT:
+            if segment.startswith("/*!"):
+                raise ValueError("Executable comments are not allowed.")
+            segment, kind = " ", CODE
+        if kind == CODE and segments and segments[-1][1] == CODE:
+            segments[-1] = (segments[-1][0] + segment, CODE)
+        else:
+            segments.append((segment, kind))
+    if segments and segments[-1][1] == CODE:
+        segments[-1] = (segments[-1][0].rstrip().rstrip(";"), CODE)
+
+    parts = []
+    words = []
+    for segment, kind in segments:
+        if kind == QUOTED:
+            parts.append(segment)
+            continue
+        if ";" in segment:
+            raise ValueError("Only a single SQL statement can be run.")
+        collapsed = " ".join(segment.split())
+        # Keep one space where the segment borders a literal
+        if segment[:1].isspace():
+            collapsed = " " + collapsed
+        if segment[-1:].isspace() and collapsed != " ":
+            collapsed += " "
+        parts.append(collapsed)
+        words.extend(segment.translate(_WORD_SEPARATORS).lower().split())
+
+    if not words or words[0] not in ("select", "with"):
+        raise ValueError("Only SELECT queries can be run.")
+    forbidden = FORBIDDEN_KEYWORDS.intersection(words)
+    if forbidden:
+        raise ValueError(f"The query uses a statement or function that is not allowed: {', '.join(sorted(forbidden)).upper()}")
+    query = "".join(parts).strip()
+    # A LIMIT anywhere (even in a subquery) is left to the model, rather than parsing where the outer query ends
+    if max_rows is not None and "limit" not in words:
+        query += f" LIMIT {max_rows}"
+    return query
+
+def run_query(db: SQLDatabase, query: str, limit: int) -> tuple:
+    """
+    Runs the query on a server-side cursor and returns at most `limit` rows,
+    with long values truncated like SQLDatabase.run does, and whether more
+    rows were left out.
+    """
+    with db._engine.begin() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(query))
+        if not result.returns_rows:
+            return [], False
+        # One extra row tells whether the result was cut without reading the rest
+        rows = result.fetchmany(limit + 1)
+        result.close()
+
+    truncated = len(rows) > limit
+    rows = [
+        tuple(truncate_word(value, length=db._max_string_length) for value in row)
+        for row in rows[:limit]
+    ]
+    return rows, truncated
+
+def format_query_result(rows: list, truncated: bool) -> str:
+    """Formats the rows for the answer prompt, noting when some were left out."""
+    if not rows:
+        return ""
+    if truncated:
+        return f"{rows}\n(Only the first {len(rows)} rows are shown; the rest were truncated.)"
+    return str(rows)
@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+
+# streamlit run puts src/ on the path; do the same here
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from preprocess import normalize_query
+
+
+class NormalizeQueryTest(unittest.TestCase):
+    def test_sentence_punctuation_case_and_spacing_are_ignored(self):
+        self.assertEqual(normalize_query("¿Cuántos artículos hay?"), normalize_query("cuántos  artículos hay"))
+        self.assertEqual(normalize_query("Hola, ¿qué tal!"), "hola qué tal")
+
+    def test_meaningful_symbols_are_kept(self):
+        for first, second in (
+            ("score < 0", "score > 0"),
+            ("rating above 4.5", "rating above 45"),
+            ("articles on 2023-01-05", "articles on 20230105"),
+            ("growth of -5%", "growth of 5"),
+        ):
+            self.assertNotEqual(normalize_query(first), normalize_query(second))
+
+    def test_decimal_point_is_kept_before_a_final_period(self):
+        self.assertEqual(normalize_query("Rating above 4.5."), "rating above 4.5")
+
+
+if __name__ == "__main__":
+    unittest.main()
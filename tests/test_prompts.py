@@ -0,0 +1,136 @@
+import os
+import sys
+import unittest
+
+# streamlit run puts src/ on the path; do the same here
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from prompts import (
+    parse_sql_output,
+    prepare_sql_query,
+    quote_reserved_columns,
+    render_response_template,
+    run_with_quoted_retry,
+)
+
+
+class PrepareSqlQueryTest(unittest.TestCase):
+    def test_line_comment_does_not_swallow_the_next_line(self):
+        query = "SELECT COUNT(*)\nFROM tourism_data\n-- only positive articles\nWHERE sentiment = 'positive'"
+        self.assertEqual(
+            prepare_sql_query(query),
+            "SELECT COUNT(*) FROM tourism_data WHERE sentiment = 'positive'",
+        )
+
+    def test_comment_markers_inside_literals_are_kept(self):
+        query = "SELECT 'a -- b', \"#\", 5--3 FROM tourism_data /* note */"
+        self.assertEqual(prepare_sql_query(query), "SELECT 'a -- b', \"#\", 5--3 FROM tourism_data")
+
+    def test_quote_in_comment_does_not_hide_keywords(self):
+        query = "SELECT * FROM tourism_data -- '\nINTO OUTFILE '/tmp/x' -- '"
+        with self.assertRaises(ValueError):
+            prepare_sql_query(query)
+
+    def test_executable_comment_is_rejected(self):
+        with self.assertRaises(ValueError):
+            prepare_sql_query("SELECT 1 /*!50000 INTO OUTFILE '/tmp/x' */")
+
+    def test_file_and_sleep_functions_are_rejected(self):
+        for query in ("SELECT LOAD_FILE('/etc/passwd')", "SELECT SLEEP(10)", "SELECT BENCHMARK(1000000, MD5('a'))"):
+            with self.assertRaises(ValueError):
+                prepare_sql_query(query)
+
+    def test_limit_is_not_swallowed_by_a_trailing_comment(self):
+        self.assertEqual(
+            prepare_sql_query("SELECT title FROM tourism_data -- newest first", max_rows=51),
+            "SELECT title FROM tourism_data LIMIT 51",
+        )
+
+    def test_existing_limit_is_kept(self):
+        self.assertEqual(
+            prepare_sql_query("SELECT title FROM tourism_data LIMIT 5;", max_rows=51),
+            "SELECT title FROM tourism_data LIMIT 5",
+        )
+
+
+class QuoteReservedColumnsTest(unittest.TestCase):
+    COLUMNS = frozenset({"group", "order", "rank"})
+
+    def test_bare_columns_are_quoted(self):
+        self.assertEqual(
+            quote_reserved_columns("SELECT rank, t.order FROM tourism_data t", self.COLUMNS),
+            "SELECT `rank`, t.`order` FROM tourism_data t",
+        )
+
+    def test_lower_case_clause_keywords_are_left_alone(self):
+        query = "select `group`, count(*) from tourism_data group by `group` order by 2 desc"
+        self.assertEqual(quote_reserved_columns(query, self.COLUMNS), query)
+
+    def test_calls_and_literals_are_left_alone(self):
+        query = "SELECT rank() OVER (ORDER BY x), 'rank' FROM tourism_data -- rank"
+        self.assertEqual(quote_reserved_columns(query, self.COLUMNS), query)
+
+
+class RunWithQuotedRetryTest(unittest.TestCase):
+    COLUMNS = frozenset({"rank"})
+
+    @staticmethod
+    def run_query(query):
+        if "`" not in query:
+            raise SQLAlchemyError("syntax error")
+        return [(1,)]
+
+    def test_rejected_query_is_retried_quoted(self):
+        self.assertEqual(
+            run_with_quoted_retry(self.run_query, "SELECT rank FROM tourism_data", self.COLUMNS),
+            ("SELECT `rank` FROM tourism_data", [(1,)]),
+        )
+
+    def test_error_is_raised_when_quoting_changes_nothing(self):
+        with self.assertRaises(SQLAlchemyError):
+            run_with_quoted_retry(self.run_query, "SELECT title FROM tourism_data", self.COLUMNS)
+
+
+
+class ParseSqlOutputTest(unittest.TestCase):
+    def test_query_and_template_are_returned(self):
+        self.assertEqual(
+            parse_sql_output('{"sql": " SELECT 1 ", "response_template": "Hay {{ rows[0][0] }}."}'),
+            ("SELECT 1", "Hay {{ rows[0][0] }}."),
+        )
+
+    def test_missing_template_is_empty(self):
+        self.assertEqual(parse_sql_output('{"sql": "SELECT 1"}'), ("SELECT 1", ""))
+
+    def test_malformed_or_empty_replies_raise(self):
+        for content in ("", "SELECT 1", "{", "[]", "{}", '{"sql": ""}', '{"sql": 1}'):
+            with self.assertRaises(ValueError):
+                parse_sql_output(content)
+
+
+class RenderResponseTemplateTest(unittest.TestCase):
+    def test_loop_template_renders(self):
+        template = "{% for sentiment, articles in rows %}{{ sentiment }}: {{ articles }}{% if not loop.last %}; {% endif %}{% endfor %}."
+        self.assertEqual(
+            render_response_template(template, [("positive", 3), ("negative", 1)]),
+            "positive: 3; negative: 1.",
+        )
+
+    def test_empty_template_falls_back(self):
+        self.assertIsNone(render_response_template("", [(1,)]))
+
+    def test_lone_null_falls_back(self):
+        self.assertIsNone(render_response_template("El máximo es {{ rows[0][0] }}.", [(None,)]))
+
+    def test_undefined_name_falls_back(self):
+        self.assertIsNone(render_response_template("Hay {{ total }} artículos.", [(1,)]))
+
+    def test_sandbox_violation_falls_back(self):
+        self.assertIsNone(render_response_template("{{ rows.append(1) }}", [(1,)]))
+        self.assertIsNone(render_response_template("{{ rows.__class__.__mro__ }}", [(1,)]))
+
+
+if __name__ == "__main__":
+    unittest.main()